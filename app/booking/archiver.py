@@ -0,0 +1,113 @@
+"""
+Moves reservations that ended more than ARCHIVE_AFTER seconds ago out of
+the Reservations table into gzip'd JSONL files under ARCHIVE_DIR, one file
+per month of the reservation's start:
+
+    ARCHIVE_DIR/reservations-2025-09.jsonl.gz
+
+The table is scanned in pages of ARCHIVE_BATCH items. Each page's old rows
+are appended to the archive (a new gzip member per batch, fsync'd) before
+they are deleted, so a crash can at worst archive a row twice, never lose
+it. Deletes are conditional on the slotId that was archived: the row key is
+(participant, creator), and a newer booking with the same creator may have
+overwritten the row in the meantime.
+
+    python -m app.booking.archiver          # every ARCHIVE_INTERVAL seconds
+    python -m app.booking.archiver --once
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+import boto3
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv, find_dotenv
+from app.models.time_slots import item_epochs
+
+load_dotenv(find_dotenv())
+
+AWS_REGION         = os.getenv("AWS_REGION", "eu-west-1")
+RESERVATIONS_TABLE = os.getenv("RESERVATIONS_TABLE", "Reservations")
+DYNAMODB_ENDPOINT  = os.getenv("DYNAMODB_ENDPOINT", "http://dynamodb-local:8000")
+ARCHIVE_DIR        = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER      = int(os.getenv("ARCHIVE_AFTER", 30 * 24 * 3600))
+ARCHIVE_BATCH      = int(os.getenv("ARCHIVE_BATCH", 500))
+ARCHIVE_INTERVAL   = int(os.getenv("ARCHIVE_INTERVAL", 3600))
+
+dynamo = boto3.resource("dynamodb", region_name=AWS_REGION, endpoint_url=DYNAMODB_ENDPOINT)
+reservations = dynamo.Table(RESERVATIONS_TABLE)
+
+
+def archive_path(start_epoch: int) -> str:
+    month = datetime.fromtimestamp(start_epoch, tz=timezone.utc).strftime("%Y-%m")
+    return os.path.join(ARCHIVE_DIR, f"reservations-{month}.jsonl.gz")
+
+
+def write_archive(items: list[dict]):
+    by_file = defaultdict(list)
+    for item in items:
+        by_file[archive_path(item_epochs(item)[0])].append(item)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    for path, rows in by_file.items():
+        with open(path, "ab") as f:
+            with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+                for row in rows:
+                    line = json.dumps(row, separators=(",", ":"), default=lambda d: int(d) if d == int(d) else float(d))
+                    gz.write(line.encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def delete_archived(items: list[dict]) -> int:
+    deleted = 0
+    for item in items:
+        try:
+            reservations.delete_item(
+                Key={"participantEmail": item["participantEmail"], "creatorEmail": item["creatorEmail"]},
+                ConditionExpression=Attr("slotId").eq(item["slotId"]),
+            )
+            deleted += 1
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+    return deleted
+
+
+def archive_once(now: float = None) -> dict:
+    cutoff = int((now or time.time()) - ARCHIVE_AFTER)
+    stats = {"scanned": 0, "archived": 0, "deleted": 0}
+    # Rows written before epochs were stored have no endEpoch and are
+    # left alone until utils.migrate_epoch has run.
+    kwargs = {"FilterExpression": Attr("endEpoch").lt(cutoff), "Limit": ARCHIVE_BATCH}
+    while True:
+        resp = reservations.scan(**kwargs)
+        stats["scanned"] += resp.get("ScannedCount", 0)
+        old = resp.get("Items", [])
+        if old:
+            write_archive(old)
+            stats["archived"] += len(old)
+            stats["deleted"] += delete_archived(old)
+        if "LastEvaluatedKey" not in resp:
+            return stats
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def main(once: bool):
+    while True:
+        try:
+            print(f"✅ Reservations archived: {archive_once()}")
+        except ClientError as e:
+            print("❌ Archiver error:", e)
+        if once:
+            return
+        time.sleep(ARCHIVE_INTERVAL)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="archive one pass and exit")
+    main(parser.parse_args().once)
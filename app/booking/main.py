@@ -1,6 +1,6 @@
 import datetime
 from fastapi import FastAPI, Header, HTTPException, Depends, Query
-from app.models.time_slots import TimeSlotIn, TimeSlotOut
+from app.models.time_slots import TimeSlotIn, TimeSlotOut, item_epochs, to_epoch
 from pydantic import BaseModel, Field
 import uuid, os, asyncio
 import aioboto3
@@ -8,8 +8,12 @@ from dotenv import load_dotenv, find_dotenv
 from app.database import database
 from app.models.user import revoked_tokens
 from boto3.dynamodb.conditions import Key
-from typing import List
+from typing import List, Optional
 from fastapi import Body
+from botocore.exceptions import ClientError
+from app.rabbit_listener.publisher import publisher
+from app.slots.events import get_dynamo_sequences, publish_slot_event
+from app.idempotency import IdempotencyMiddleware
 import consul
 import socket
 
@@ -21,6 +25,7 @@ RESERVATIONS_TABLE = os.getenv("RESERVATIONS_TABLE", "Reservations")
 DYNAMODB_ENDPOINT = os.getenv("DYNAMODB_ENDPOINT", "http://dynamodb-local:8000")
 
 app = FastAPI(title="Booking Service")
+app.add_middleware(IdempotencyMiddleware)
 
 CONSUL_HOST  = os.getenv("CONSUL_HOST", "consul")
 CONSUL_PORT  = int(os.getenv("CONSUL_PORT", 8500))
@@ -45,10 +50,12 @@ async def startup():
         )
     )
     app.state.consul_service_id = svc_id
+    await database.connect()
 
 @app.on_event("shutdown")
 async def shutdown():
     consul_client.agent.service.deregister(app.state.consul_service_id)
+    await database.disconnect()
 
 @app.get("/health")
 async def health():
@@ -58,6 +65,15 @@ class BookingIn(BaseModel):
     timeslot:     TimeSlotIn
     participants: List[str] = Field(..., example=["alice@example.com", "bob@example.com"])
 
+class BookingRequest(BaseModel):
+    slot_id:      str
+    host_email:   str
+    participants: List[str] = Field(..., example=["alice@example.com", "bob@example.com"])
+
+class BookingResponse(BaseModel):
+    success: bool
+    slot_id: str
+
 class BookingOut(BaseModel):
     slot_id: str
     user_email: str
@@ -68,13 +84,13 @@ class BookingOut(BaseModel):
 async def get_dynamo_slots():
     session = aioboto3.Session()
     async with session.resource("dynamodb", region_name=AWS_REGION, endpoint_url=DYNAMODB_ENDPOINT) as dynamo:
-      table = await dynamo.Table("TimeSlots")
+      table = await dynamo.Table(TABLE_NAME)
       yield table
 
 async def get_dynamo_reservations():
     session = aioboto3.Session()
     async with session.resource("dynamodb", region_name=AWS_REGION, endpoint_url=DYNAMODB_ENDPOINT) as dynamo:
-      table = await dynamo.Table("Reservations")
+      table = await dynamo.Table(RESERVATIONS_TABLE)
       yield table
 
 async def get_current_user_email(Authorization: str = Header(...)) -> str:
@@ -94,3 +110,105 @@ async def get_current_user_email(Authorization: str = Header(...)) -> str:
         raise HTTPException(401, "Token has no subject")
     return user_email
 
+
+@app.post("/booking", response_model=BookingResponse, status_code=202)
+async def create_booking(
+    data: BookingRequest,
+    current_user_email: str = Depends(get_current_user_email),
+    slot_table = Depends(get_dynamo_slots),
+    seq_table = Depends(get_dynamo_sequences),
+):
+    """
+    Claims the slot and hands the rest of the booking to the
+    `booking.created` consumer, which writes one Reservations row per
+    participant. The request returns as soon as the slot is ours, however
+    many participants there are.
+    """
+    # Deleting with a condition is the atomic claim: of two concurrent
+    # bookings for the same slot only one gets the old item back.
+    try:
+        resp = await slot_table.delete_item(
+            Key={"userEmail": data.host_email, "slotId": data.slot_id},
+            ConditionExpression="attribute_exists(slotId)",
+            ReturnValues="ALL_OLD",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            raise HTTPException(409, "The slot is no longer available.")
+        raise
+    slot = resp["Attributes"]
+    start_epoch, end_epoch = item_epochs(slot)
+
+    event = {
+        "slot_id":       data.slot_id,
+        "host_email":    data.host_email,
+        "creator_email": current_user_email,
+        "start_time":    slot["startTime"],
+        "end_time":      slot["endTime"],
+        "start_epoch":   start_epoch,
+        "end_epoch":     end_epoch,
+        "participants":  data.participants,
+    }
+    # Fails fast (see Publisher), so the client hears back well within the
+    # façade's timeout whether or not the booking was queued.
+    try:
+        await asyncio.to_thread(publisher.publish, "booking.created", event)
+    except Exception as e:
+        print("❌ Could not publish booking.created:", e)
+        await slot_table.put_item(Item=slot)
+        raise HTTPException(503, "Booking could not be queued, please retry.")
+    await publish_slot_event(seq_table, "booked", data.host_email, [{"slot_id": data.slot_id}])
+
+    return BookingResponse(success=True, slot_id=data.slot_id)
+
+
+RESERVATIONS_BY_START = "participantStart"   # GSI: participantEmail + startEpoch
+
+@app.get("/booking", response_model=list[BookingOut])
+async def list_bookings(
+    since: Optional[str] = Query(None, description="ISO 8601; only bookings starting at or after it"),
+    current_user_email: str = Depends(get_current_user_email),
+    reservations_table = Depends(get_dynamo_reservations),
+):
+    if since is None:
+        resp = await reservations_table.query(
+            KeyConditionExpression=Key("participantEmail").eq(current_user_email)
+        )
+    else:
+        try:
+            since_epoch = to_epoch(since)
+        except ValueError:
+            raise HTTPException(400, "`since` must be an ISO 8601 date-time")
+        resp = await reservations_table.query(
+            IndexName=RESERVATIONS_BY_START,
+            KeyConditionExpression=Key("participantEmail").eq(current_user_email)
+                                   & Key("startEpoch").gte(since_epoch),
+        )
+    items = sorted(resp.get("Items", []), key=item_epochs)
+
+    slots_map = {}
+    for it in items:
+        sid = it["slotId"]
+        if sid not in slots_map:
+            slots_map[sid] = {
+                "slot_id":    sid,
+                "user_email": it["creatorEmail"],
+                "start_time": it["startTime"],
+                "end_time":   it["endTime"],
+                "participants": set(),
+            }
+        slots_map[sid]["participants"].add(it["participantEmail"])
+
+    result = []
+    for data in slots_map.values():
+        result.append(
+            BookingOut(
+                slot_id=data["slot_id"],
+                user_email=data["user_email"],
+                start_time=data["start_time"],
+                end_time=data["end_time"],
+                participants=list(data["participants"]),
+            )
+        )
+
+    return result
@@ -0,0 +1,191 @@
+"""
+Admission control for the façade: per-service concurrency limits with a
+bounded wait queue, and token-bucket rate limits per user or client IP.
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+
+from starlette.responses import JSONResponse
+
+CONCURRENCY_LIMIT   = int(os.getenv("CONCURRENCY_LIMIT", 64))
+CONCURRENCY_QUEUE   = int(os.getenv("CONCURRENCY_QUEUE", 128))
+QUEUE_TIMEOUT       = float(os.getenv("QUEUE_TIMEOUT", 1.0))
+RATE_LIMIT_IDLE     = float(os.getenv("RATE_LIMIT_IDLE", 60))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100_000))
+
+# SERVICE_CONCURRENCY='{"auth-service": 16}' overrides CONCURRENCY_LIMIT per service.
+SERVICE_CONCURRENCY = json.loads(os.getenv("SERVICE_CONCURRENCY", "{}"))
+
+# Quota name -> (tokens per second, burst). RATE_LIMITS='{"auth": [0.5, 5]}'
+# overrides entries. "auth" covers /login and /register and "client" every
+# other route, both keyed by client IP and checked before anything else.
+# "user" is keyed by the caller's email and checked once verify() has
+# accepted the token: an unverified header is whatever the client wants it
+# to be, so it cannot key a quota.
+RATE_LIMITS = {
+    "auth":   (1.0, 10),
+    "client": (50.0, 100),
+    "user":   (20.0, 40),
+}
+RATE_LIMITS.update({name: tuple(quota) for name, quota in json.loads(os.getenv("RATE_LIMITS", "{}")).items()})
+
+AUTH_ROUTES     = {"/login", "/register"}
+UNLIMITED_PATHS = {"/health", "/metrics"}
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+    """
+    At most `limit` calls run at once; up to `queue_size` more wait in FIFO
+    order for at most `queue_timeout` seconds. Anything beyond that is
+    rejected immediately, which is what keeps an overloaded upstream from
+    dragging the façade down with it.
+    """
+    def __init__(self, limit: int, queue_size: int = CONCURRENCY_QUEUE, queue_timeout: float = QUEUE_TIMEOUT):
+        self.limit         = limit
+        self.queue_size    = queue_size
+        self.queue_timeout = queue_timeout
+        self.active        = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.rejected      = 0
+        self.timed_out     = 0
+
+    async def __aenter__(self):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return self
+        if len(self.waiters) >= self.queue_size:
+            self.rejected += 1
+            raise Overloaded()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # We were handed a slot just as we gave up; pass it on.
+                self._release()
+            else:
+                try:
+                    self.waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise Overloaded() from None
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self._release()
+
+    def _release(self):
+        # The slot goes straight to the oldest waiter, so `active` only
+        # drops when nobody is queued.
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            "limit":     self.limit,
+            "active":    self.active,
+            "queued":    len(self.waiters),
+            "rejected":  self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+def concurrency_limiter(service_name: str) -> ConcurrencyLimiter:
+    return ConcurrencyLimiter(SERVICE_CONCURRENCY.get(service_name, CONCURRENCY_LIMIT))
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by caller. Buckets live in an OrderedDict kept in
+    last-use order, so evicting idle ones is a pop from the front and memory
+    stays proportional to the callers seen in the last idle window. A bucket
+    idle for burst/rate seconds is full again, so dropping it loses nothing.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate     = rate
+        self.burst    = burst
+        self.idle     = max(RATE_LIMIT_IDLE, burst / rate)
+        self.buckets: OrderedDict[str, list[float]] = OrderedDict()
+        self.allowed  = 0
+        self.rejected = 0
+
+    def acquire(self, key: str, cost: int = 1) -> float:
+        """
+        Takes `cost` tokens for `key`. Returns 0 when the call is allowed,
+        otherwise the number of seconds until enough tokens are available.
+        A cost above `burst` can never be allowed.
+        """
+        now = time.monotonic()
+        self._evict(now)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self.buckets.move_to_end(key)
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            self.allowed += 1
+            return 0
+        self.rejected += 1
+        return (cost - bucket[0]) / self.rate
+
+    def _evict(self, now: float):
+        while self.buckets:
+            key, (_, updated_at) = next(iter(self.buckets.items()))
+            if now - updated_at < self.idle and len(self.buckets) < RATE_LIMIT_MAX_KEYS:
+                break
+            del self.buckets[key]
+
+    def snapshot(self) -> dict:
+        return {
+            "rate":     self.rate,
+            "burst":    self.burst,
+            "keys":     len(self.buckets),
+            "allowed":  self.allowed,
+            "rejected": self.rejected,
+        }
+
+
+class RateLimitMiddleware:
+    """
+    Plain ASGI middleware so a rejected request costs a dict lookup and a
+    tiny response, with no request parsing or upstream call.
+    """
+    def __init__(self, app, limiters: dict[str, RateLimiter]):
+        self.app = app
+        self.limiters = limiters
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in UNLIMITED_PATHS:
+            return await self.app(scope, receive, send)
+
+        ip = scope["client"][0] if scope.get("client") else "unknown"
+        name = "auth" if scope["path"] in AUTH_ROUTES else "client"
+        retry_after = self.limiters[name].acquire(ip)
+        if retry_after:
+            response = JSONResponse(
+                {"detail": "Too many requests"},
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+            return await response(scope, receive, send)
+        return await self.app(scope, receive, send)
@@ -0,0 +1,245 @@
+"""
+Client-side load balancing for the façade.
+
+Every upstream call is wrapped in LoadBalancer.start()/finish(), so the façade
+keeps its own view of each instance: requests in flight, a latency EWMA and
+runs of failed or slow calls. Strategies pick an instance from that view, and
+instances that keep failing or keep answering slowly are ejected for a while.
+
+Calls that carry an affinity key (the user whose data they touch) go to the
+key's owner on a consistent-hash ring over the service's healthy instances
+instead, so per-user caches on that instance keep getting hits. The strategy
+takes over when the owner is overloaded.
+"""
+import bisect
+import hashlib
+import math
+import os
+import random
+import time
+
+LB_STRATEGY       = os.getenv("LB_STRATEGY", "p2c")
+EWMA_DECAY        = float(os.getenv("LB_EWMA_DECAY", 10))        # seconds
+SLOW_CALL_SECONDS = float(os.getenv("LB_SLOW_CALL_SECONDS", 2))
+EJECT_FAILURES    = int(os.getenv("LB_EJECT_FAILURES", 5))
+EJECT_SLOW_CALLS  = int(os.getenv("LB_EJECT_SLOW_CALLS", 5))
+EJECT_SECONDS     = float(os.getenv("LB_EJECT_SECONDS", 30))
+MAX_EJECT_RATIO   = float(os.getenv("LB_MAX_EJECT_RATIO", 0.5))
+LB_AFFINITY       = os.getenv("LB_AFFINITY", "1") == "1"
+RING_VNODES       = int(os.getenv("LB_RING_VNODES", 100))
+# Bounded load: the owner is skipped while it has more than this factor
+# times its fair share of the service's requests in flight, plus one.
+AFFINITY_LOAD     = float(os.getenv("LB_AFFINITY_LOAD", 1.25))
+
+
+class InstanceStats:
+    def __init__(self):
+        self.outstanding   = 0
+        self.ewma          = 0.0   # seconds
+        self.updated_at    = time.monotonic()
+        self.failures      = 0     # consecutive
+        self.slow_calls    = 0     # consecutive
+        self.ejected_until = 0.0
+        self.requests      = 0
+        self.errors        = 0
+
+    def observe(self, latency: float, ok: bool):
+        now = time.monotonic()
+        if self.requests == 0:
+            self.ewma = latency
+        else:
+            # Time-decayed EWMA: old samples fade out after a few EWMA_DECAY
+            # seconds no matter how much traffic the instance gets.
+            w = math.exp(-(now - self.updated_at) / EWMA_DECAY)
+            self.ewma = self.ewma * w + latency * (1 - w)
+        self.updated_at = now
+        self.requests += 1
+
+        if ok:
+            self.failures = 0
+        else:
+            self.failures += 1
+            self.errors += 1
+        if latency >= SLOW_CALL_SECONDS:
+            self.slow_calls += 1
+        else:
+            self.slow_calls = 0
+
+    def latency(self) -> float:
+        # An idle instance's estimate fades towards zero so that one slow
+        # call does not starve it forever; the next probe re-measures it.
+        idle = time.monotonic() - self.updated_at
+        return self.ewma * math.exp(-idle / EWMA_DECAY)
+
+    def cost(self) -> float:
+        # Expected latency times the queue already waiting on this instance.
+        return max(self.latency(), 0.001) * (self.outstanding + 1)
+
+
+def _round_robin(lb: "LoadBalancer", service_name: str, candidates: list[str]) -> str:
+    n = lb._rr.get(service_name, 0)
+    lb._rr[service_name] = n + 1
+    return candidates[n % len(candidates)]
+
+
+def _power_of_two(lb: "LoadBalancer", service_name: str, candidates: list[str]) -> str:
+    if len(candidates) == 1:
+        return candidates[0]
+    stats = lb.stats[service_name]
+    a, b = random.sample(candidates, 2)
+    sa, sb = stats[a], stats[b]
+    if sa.outstanding != sb.outstanding:
+        return a if sa.outstanding < sb.outstanding else b
+    return a if sa.latency() <= sb.latency() else b
+
+
+def _ewma(lb: "LoadBalancer", service_name: str, candidates: list[str]) -> str:
+    stats = lb.stats[service_name]
+    weights = [1 / stats[url].cost() for url in candidates]
+    return random.choices(candidates, weights=weights)[0]
+
+
+def _random(lb: "LoadBalancer", service_name: str, candidates: list[str]) -> str:
+    return random.choice(candidates)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent-hash ring with RING_VNODES points per member. A member
+    joining or leaving only moves the keys on its own points, about 1/n of
+    them.
+    """
+    def __init__(self, members, vnodes: int = RING_VNODES):
+        self.members = frozenset(members)
+        points = sorted((_hash(f"{member}#{i}"), member) for member in self.members for i in range(vnodes))
+        self.hashes = [h for h, _ in points]
+        self.owners = [member for _, member in points]
+
+    def walk(self, key: str):
+        """Distinct members clockwise from the key: its owner first."""
+        if not self.hashes:
+            return
+        start = bisect.bisect(self.hashes, _hash(key))
+        seen = set()
+        for i in range(len(self.owners)):
+            member = self.owners[(start + i) % len(self.owners)]
+            if member not in seen:
+                seen.add(member)
+                yield member
+                if len(seen) == len(self.members):
+                    return
+
+
+STRATEGIES = {
+    "round_robin": _round_robin,
+    "p2c":         _power_of_two,
+    "ewma":        _ewma,
+    "random":      _random,
+}
+
+
+class LoadBalancer:
+    def __init__(self, strategy: str = LB_STRATEGY):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown LB_STRATEGY `{strategy}`, expected one of {sorted(STRATEGIES)}")
+        self.strategy = strategy
+        self.stats: dict[str, dict[str, InstanceStats]] = {}
+        self._rr: dict[str, int] = {}
+        self.rings: dict[str, HashRing] = {}
+        self.affinity = {"hits": 0, "overloaded": 0}
+
+    def choose(self, service_name: str, urls: list[str], exclude=(), affinity_key: str = None) -> str:
+        """
+        Picks one of the healthy instances Consul returned for the service,
+        avoiding `exclude` (instances already tried) while others are left.
+        With an affinity key the pick is the key's owner on the ring.
+        """
+        known = self.stats.setdefault(service_name, {})
+        for url in urls:
+            if url not in known:
+                known[url] = InstanceStats()
+        if len(known) > len(urls):
+            for url in set(known).difference(urls):
+                del known[url]
+
+        candidates = self._not_ejected(known, [url for url in urls if url not in exclude] or urls)
+        if affinity_key and LB_AFFINITY:
+            owner = self._owner(service_name, urls, candidates, affinity_key)
+            if owner is not None:
+                return owner
+        return STRATEGIES[self.strategy](self, service_name, candidates)
+
+    def _owner(self, service_name: str, urls: list[str], candidates: list[str], key: str) -> str | None:
+        # The ring spans every healthy instance, not just the candidates,
+        # so a retry or an ejection moves only this call to the next
+        # member and not the key for everyone else.
+        ring = self.rings.get(service_name)
+        if ring is None or ring.members != frozenset(urls):
+            ring = self.rings[service_name] = HashRing(urls)
+        allowed = set(candidates)
+        owner = next((url for url in ring.walk(key) if url in allowed), None)
+        if owner is None:
+            return None
+        stats = self.stats[service_name]
+        in_flight = sum(stats[url].outstanding for url in candidates)
+        if stats[owner].outstanding > AFFINITY_LOAD * in_flight / len(candidates) + 1:
+            self.affinity["overloaded"] += 1
+            return None
+        self.affinity["hits"] += 1
+        return owner
+
+    def _not_ejected(self, known: dict[str, InstanceStats], urls: list[str]) -> list[str]:
+        now = time.monotonic()
+        ejected = sorted(
+            (url for url in urls if known[url].ejected_until > now),
+            key=lambda url: known[url].ejected_until,
+        )
+        if not ejected:
+            return urls
+        # Never eject more than MAX_EJECT_RATIO of a service: when too many
+        # instances look bad the problem is usually not the instances.
+        allowed = int(len(urls) * MAX_EJECT_RATIO)
+        skip = set(ejected[max(0, len(ejected) - allowed):]) if allowed else set()
+        return [url for url in urls if url not in skip]
+
+    def start(self, service_name: str, url: str) -> InstanceStats:
+        stats = self.stats.setdefault(service_name, {}).setdefault(url, InstanceStats())
+        stats.outstanding += 1
+        return stats
+
+    def finish(self, stats: InstanceStats, latency: float, ok: bool):
+        stats.outstanding -= 1
+        stats.observe(latency, ok)
+        if stats.failures >= EJECT_FAILURES or stats.slow_calls >= EJECT_SLOW_CALLS:
+            stats.ejected_until = time.monotonic() + EJECT_SECONDS
+            stats.failures = 0
+            stats.slow_calls = 0
+
+    def abandon(self, stats: InstanceStats):
+        # Call cancelled by us (e.g. the losing side of a hedge): not the
+        # instance's fault, so it must not count as a failure or a sample.
+        stats.outstanding -= 1
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {
+            "strategy": self.strategy,
+            "affinity": dict(self.affinity, enabled=LB_AFFINITY),
+            "services": {
+                service_name: {
+                    url: {
+                        "outstanding": s.outstanding,
+                        "ewma_ms":     round(s.latency() * 1000, 1),
+                        "requests":    s.requests,
+                        "errors":      s.errors,
+                        "ejected":     s.ejected_until > now,
+                    }
+                    for url, s in instances.items()
+                }
+                for service_name, instances in self.stats.items()
+            },
+        }
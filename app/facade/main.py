@@ -1,11 +1,25 @@
-import os, random
+import asyncio, base64, json, math, os, re, time
+from collections import defaultdict
 import consul
 import httpx
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+from balancer import LoadBalancer
+from idempotency import IdempotencyMiddleware
+from admission import (ConcurrencyLimiter, Overloaded, RateLimiter, RateLimitMiddleware,
+                       RATE_LIMITS, concurrency_limiter)
+from live import Hub, bookings_topic, slots_topic, start_consumer
+from resilience import (CircuitBreaker, CircuitOpen, LatencyTracker, RetryBudget,
+                        HEDGE_PERCENTILE, route_timeout)
 app = FastAPI(title="API Gateway / Façade")
 
+rate_limiters = {name: RateLimiter(rate, burst) for name, (rate, burst) in RATE_LIMITS.items()}
+
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(RateLimitMiddleware, limiters=rate_limiters)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -18,71 +32,308 @@ CONSUL_HOST = os.getenv("CONSUL_HOST", "consul")
 CONSUL_PORT = int(os.getenv("CONSUL_PORT", 8500))
 consul_client = consul.Consul(host=CONSUL_HOST, port=CONSUL_PORT)
 
-def pick(service_name: str) -> str:
+balancer = LoadBalancer()
+
+breakers: dict[str, CircuitBreaker] = defaultdict(CircuitBreaker)
+budgets: dict[str, RetryBudget] = defaultdict(RetryBudget)
+latencies: dict[str, LatencyTracker] = defaultdict(LatencyTracker)
+limiters: dict[str, ConcurrencyLimiter] = {}
+
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", 2))
+# Set when the services share IDEMPOTENCY_TABLE: only then does a retried
+# write with an Idempotency-Key replay the first attempt on another replica
+# instead of running again.
+RETRY_KEYED_WRITES = os.getenv("RETRY_KEYED_WRITES", "0") == "1"
+
+# One pooled client for all upstream calls, so requests reuse keep-alive
+# connections instead of paying a TCP handshake each time.
+http_client = httpx.AsyncClient(limits=httpx.Limits(
+    max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 200)),
+    max_keepalive_connections=int(os.getenv("UPSTREAM_KEEPALIVE_CONNECTIONS", 50)),
+))
+
+hub = Hub()
+
+@app.on_event("startup")
+async def startup():
+    start_consumer(hub, asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await http_client.aclose()
+
+def pick(service_name: str, exclude=(), affinity_key: str = None) -> str:
+    """
+    A healthy instance of the service. With an affinity key (the user the
+    call is about) it is the key's owner on the consistent-hash ring, so
+    that user's requests keep hitting the same replica's caches.
+    """
     _, nodes = consul_client.health.service(service_name, passing=True)
     if not nodes:
         raise HTTPException(503, f"No healthy `{service_name}` instances")
-    svc = random.choice(nodes)["Service"]
-    return f"http://{svc['Address']}:{svc['Port']}"
+    urls = [f"http://{n['Service']['Address']}:{n['Service']['Port']}" for n in nodes]
+    return balancer.choose(service_name, urls, exclude, affinity_key)
 
-async def verify(token: str) -> bool:
+async def send(service_name: str, method: str, path: str, timeout: float, tried: set,
+               affinity_key: str = None, **kwargs) -> httpx.Response:
+    """
+    Sends one request to an instance of the service not in `tried` and
+    records the outcome in the balancer's per-instance stats.
+    """
+    url = pick(service_name, tried, affinity_key)
+    tried.add(url)
+    stats = balancer.start(service_name, url)
+    started = time.monotonic()
+    try:
+        r = await http_client.request(method, url + path, timeout=timeout, **kwargs)
+    except asyncio.CancelledError:
+        balancer.abandon(stats)
+        raise
+    except httpx.HTTPError:
+        balancer.finish(stats, time.monotonic() - started, False)
+        raise
+    balancer.finish(stats, time.monotonic() - started, r.status_code < 500)
+    return r
+
+async def hedged(service_name: str, method: str, path: str, timeout: float, tried: set,
+                 delay: float, **kwargs) -> httpx.Response:
+    """
+    Sends the request and, if it is still running after `delay`, a second
+    copy to another instance; the first good answer wins.
+    """
+    first = asyncio.create_task(send(service_name, method, path, timeout, tried, **kwargs))
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done or not budgets[service_name].withdraw():
+        return await first
+    budgets[service_name].hedges += 1
+    second = asyncio.create_task(send(service_name, method, path, timeout, tried, **kwargs))
+    pending = {first, second}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not pending or (task.exception() is None and task.result().status_code < 500):
+                    return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def forward(service_name: str, method: str, path: str, **kwargs) -> httpx.Response:
+    """
+    Admits the call against the service's concurrency limit and sheds it
+    with a 503 when the limit and its wait queue are both full.
+    """
+    if service_name not in limiters:
+        limiters[service_name] = concurrency_limiter(service_name)
+    try:
+        async with limiters[service_name]:
+            return await call_upstream(service_name, method, path, **kwargs)
+    except Overloaded:
+        raise HTTPException(503, f"`{service_name}` is overloaded", headers={"Retry-After": "1"})
+
+async def call_upstream(service_name: str, method: str, path: str, *, route: str = None,
+                        idempotent: bool = False, affinity_key: str = None, **kwargs) -> httpx.Response:
+    """
+    Calls the service through its circuit breaker with the route's timeout.
+    Idempotent calls are retried on another instance while the service's
+    retry budget allows it, and idempotent GETs are hedged when
+    HEDGE_PERCENTILE is set. A hedged write could at best wait for the
+    original's idempotency claim, and at worst run twice.
+    """
+    route = route or f"{method} {path}"
+    timeout = route_timeout(route)
+    breaker = breakers[service_name]
+    budget = budgets[service_name]
+    budget.deposit()
+    tried = set()
+    for attempt in range(1 + (MAX_RETRIES if idempotent else 0)):
+        if attempt and not budget.withdraw():
+            break
+        if attempt:
+            budget.retries += 1
+        try:
+            probe = breaker.acquire()
+        except CircuitOpen:
+            raise HTTPException(503, f"`{service_name}` is unavailable (circuit open)")
+
+        started = time.monotonic()
+        hedge = idempotent and method == "GET" and HEDGE_PERCENTILE
+        delay = latencies[route].percentile(HEDGE_PERCENTILE) if hedge else None
+        try:
+            if delay is not None:
+                r = await hedged(service_name, method, path, timeout, tried, delay,
+                                 affinity_key=affinity_key, **kwargs)
+            else:
+                r = await send(service_name, method, path, timeout, tried, affinity_key, **kwargs)
+        except httpx.TimeoutException:
+            breaker.record(False, probe)
+            error = HTTPException(504, f"`{service_name}` timed out")
+        except httpx.TransportError:
+            breaker.record(False, probe)
+            error = HTTPException(502, f"`{service_name}` is unreachable")
+        except asyncio.CancelledError:
+            breaker.release(probe)
+            raise
+        except Exception:
+            breaker.record(False, probe)
+            raise
+        else:
+            ok = r.status_code < 500
+            breaker.record(ok, probe)
+            latencies[route].add(time.monotonic() - started)
+            if ok or not idempotent:
+                return r
+            error = None
+    if error is None:
+        return r
+    raise error
+
+async def verify(token: str, cost: int = 1) -> bool:
+    """
+    Checks the token with auth-service, then takes `cost` requests from the
+    caller's "user" quota; a caller over quota gets a 429.
+    """
     print("Token ", token)
-    url = pick("auth-service") + "/verify"
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url, headers={"auth-token": f"{token}"})
-        print("Response ", r)
-        return r.status_code == 200
+    r = await forward("auth-service", "GET", "/verify", idempotent=True, headers={"auth-token": f"{token}"})
+    print("Response ", r)
+    if r.status_code != 200:
+        return False
+    retry_after = rate_limiters["user"].acquire(token_email(token) or token, cost)
+    if retry_after:
+        raise too_many_requests(retry_after)
+    return True
+
+def too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(429, "Too many requests", headers={"Retry-After": str(math.ceil(retry_after))})
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "balancer": balancer.snapshot(),
+        "breakers": {name: b.snapshot() for name, b in breakers.items()},
+        "retries":  {name: b.snapshot() for name, b in budgets.items()},
+        "live":     hub.snapshot(),
+        "admission": {
+            "concurrency": {name: l.snapshot() for name, l in limiters.items()},
+            "rate_limits": {name: l.snapshot() for name, l in rate_limiters.items()},
+        },
+    }
+
 @app.post("/login")
 async def login(payload: dict):
-    url = pick("auth-service") + "/login"
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url, json=payload)
-        return r.json()
+    r = await forward("auth-service", "POST", "/login", json=payload)
+    return r.json()
 
 @app.post("/register")
 async def register(payload: dict):
-    url = pick("auth-service") + "/register"
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url, json=payload)
-        return r.json()
+    r = await forward("auth-service", "POST", "/register", json=payload)
+    return r.json()
+
+# Upstream calls behind the authenticated routes. The routes below and
+# /batch share them, so a batched sub-request behaves like the real route.
+# Writes that carry an Idempotency-Key pass it on to the service, which
+# makes them safe to retry when RETRY_KEYED_WRITES says the replicas share
+# the key store.
+
+def keyed_retry(idempotency_key: str | None) -> bool:
+    return bool(idempotency_key) and RETRY_KEYED_WRITES
+
+def upstream_headers(authorization: str, idempotency_key: str | None = None) -> dict:
+    headers = {"Authorization": authorization}
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+    return headers
+
+def token_email(authorization: str) -> str | None:
+    """
+    Email claim of a bearer token. Only trust it after verify() accepted
+    the token: the signature is not checked here. Routing by it is fine
+    either way, the service still checks the token.
+    """
+    try:
+        payload = authorization[7:].strip().split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return None
+    email = claims.get("email") if isinstance(claims, dict) else None
+    return email if isinstance(email, str) else None
+
+async def create_booking(authorization: str, params: dict, body, idempotency_key: str = None):
+    return await forward("booking-service", "POST", "/booking", json=body,
+                         idempotent=keyed_retry(idempotency_key),
+                         headers=upstream_headers(authorization, idempotency_key))
+
+async def list_bookings(authorization: str, params: dict, body):
+    return await forward("booking-service", "GET", "/booking", idempotent=True,
+                         headers={"Authorization": authorization})
+
+async def list_slots(authorization: str, params: dict, body):
+    return await forward("slots-service", "GET", "/slots", idempotent=True,
+                         params={"user_email": params["email"]},
+                         headers={"Authorization": authorization})
+
+async def search_slots(authorization: str, params: dict, body):
+    return await forward("slots-service", "GET", "/slots/search", idempotent=True,
+                         params={k: params[k] for k in ("from", "to", "min_duration", "limit", "cursor") if k in params},
+                         headers={"Authorization": authorization})
+
+async def create_slot(authorization: str, params: dict, body, idempotency_key: str = None):
+    return await forward("slots-service", "POST", "/slots", json=body,
+                         idempotent=keyed_retry(idempotency_key),
+                         headers=upstream_headers(authorization, idempotency_key))
+
+async def create_slots_batch(authorization: str, params: dict, body, idempotency_key: str = None):
+    return await forward("slots-service", "POST", "/slots/batch", json=body,
+                         idempotent=keyed_retry(idempotency_key),
+                         headers=upstream_headers(authorization, idempotency_key))
+
+async def remove_slot(authorization: str, params: dict, body, slot_id: str, idempotency_key: str = None):
+    return await forward("slots-service", "DELETE", f"/slots/{slot_id}", route="DELETE /slots/{slot_id}",
+                         idempotent=keyed_retry(idempotency_key),
+                         headers=upstream_headers(authorization, idempotency_key))
+
+async def list_free_slots(authorization: str, params: dict, body):
+    # free-slots-service caches each user's slots in memory: keep a user on one replica.
+    return await forward("free-slots-service", "GET", "/free-slots", idempotent=True,
+                         affinity_key=token_email(authorization),
+                         json={"start_time": params["start_time"], "end_time": params["end_time"]},
+                         headers={"auth-token": authorization[7:].strip()})
 
 @app.post("/booking")
-async def book(booking: dict, authorization: str = Header(...)):
+async def book(booking: dict, authorization: str = Header(...),
+               idempotency_key: Optional[str] = Header(None)):
     if not await verify(authorization):
         raise HTTPException(401, "Invalid token")
-    url = pick("slots-service") + "/booking"
     # print("Book boo", booking)
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url, json=booking, headers={"Authorization": authorization})
-        return r.json()
+    r = await create_booking(authorization, {}, booking, idempotency_key)
+    return JSONResponse(r.json(), status_code=r.status_code)
     
 @app.get("/bookings")
 async def user_bookings(authorization: str = Header(...)):
     if not await verify(authorization):
         raise HTTPException(401, "Invalid token")
-    url = pick("slots-service") + "/booking"
-    print("Found uri slots")
-
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url, headers={"Authorization": authorization})
-        r.raise_for_status()
-        return r.json()
+    r = await list_bookings(authorization, {}, None)
+    r.raise_for_status()
+    return r.json()
 
 @app.get("/slots")
 async def slots(email:str, authorization: str = Header(...)):
     if not await verify(authorization):
         raise HTTPException(401, "Invalid token")
-    url = pick("slots-service") + "/slots"
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url, params={"user_email": email},
-                              headers={"Authorization": authorization})
-        return r.json()
+    r = await list_slots(authorization, {"email": email}, None)
+    return r.json()
     
+@app.get("/slots/search")
+async def slots_search(request: Request, authorization: str = Header(...)):
+    if not await verify(authorization):
+        raise HTTPException(401, "Invalid token")
+    r = await search_slots(authorization, dict(request.query_params), None)
+    return JSONResponse(r.json(), status_code=r.status_code)
+
 class TimeSlotIn(BaseModel):
     start_time: str
     end_time: str
@@ -90,26 +341,189 @@ class TimeSlotIn(BaseModel):
 @app.post("/slots")
 async def slots_pos(
     slot: dict,
-    authorization: str = Header(...)
+    authorization: str = Header(...),
+    idempotency_key: Optional[str] = Header(None)
 ):
     print("slots recieved", slot)
     if not await verify(authorization):
         raise HTTPException(401, "Invalid token")
-    url = pick("slots-service") + "/slots"
-    async with httpx.AsyncClient() as client:
-        print("Sended slots")
-        r = await client.post(url, json=slot,
-                              headers={"Authorization": authorization})
-        return r.json()
+    r = await create_slot(authorization, {}, slot, idempotency_key)
+    return JSONResponse(r.json(), status_code=r.status_code)
     
+@app.post("/slots/batch")
+async def slots_batch(batch: dict, authorization: str = Header(...),
+                      idempotency_key: Optional[str] = Header(None)):
+    if not await verify(authorization):
+        raise HTTPException(401, "Invalid token")
+    r = await create_slots_batch(authorization, {}, batch, idempotency_key)
+    return JSONResponse(r.json(), status_code=r.status_code)
 
 @app.delete("/slots/{slot_id}")
 async def delete_slot(
     slot_id: str,
-    authorization: str = Header(...)
+    authorization: str = Header(...),
+    idempotency_key: Optional[str] = Header(None)
 ):  
-    url = pick("slots-service") + f"/slots/{slot_id}"
-    async with httpx.AsyncClient() as client:
-        r = await client.delete(url,
-                              headers={"Authorization": authorization})
-        return r.json()
+    r = await remove_slot(authorization, {}, None, slot_id, idempotency_key)
+    return JSONResponse(r.json(), status_code=r.status_code)
+
+@app.get("/free-slots")
+async def free_slots(start_time: str, end_time: str, authorization: str = Header(...)):
+    if not await verify(authorization):
+        raise HTTPException(401, "Invalid token")
+    r = await list_free_slots(authorization, {"start_time": start_time, "end_time": end_time}, None)
+    return r.json()
+
+
+BATCH_MAX_ITEMS   = int(os.getenv("BATCH_MAX_ITEMS", 20))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+
+# (method, path, handler, query parameters the handler requires)
+BATCH_ROUTES = [
+    ("GET",    re.compile(r"^/slots$"),                      list_slots,         ("email",)),
+    ("GET",    re.compile(r"^/slots/search$"),               search_slots,       ()),
+    ("POST",   re.compile(r"^/slots$"),                      create_slot,        ()),
+    ("POST",   re.compile(r"^/slots/batch$"),                create_slots_batch, ()),
+    ("DELETE", re.compile(r"^/slots/(?P<slot_id>[^/]+)$"),   remove_slot,        ()),
+    ("GET",    re.compile(r"^/bookings$"),                   list_bookings,      ()),
+    ("POST",   re.compile(r"^/booking$"),                    create_booking,     ()),
+    ("GET",    re.compile(r"^/free-slots$"),                 list_free_slots,    ("start_time", "end_time")),
+]
+
+class SubRequest(BaseModel):
+    method: str
+    path:   str
+    params: Dict[str, str] = {}
+    body:   Optional[Any] = None
+    # Forwarded to the service for writes, as on the real route.
+    idempotency_key: Optional[str] = None
+
+class BatchIn(BaseModel):
+    requests: List[SubRequest]
+
+async def dispatch(sub: SubRequest, authorization: str) -> dict:
+    for method, pattern, handler, required in BATCH_ROUTES:
+        match = pattern.match(sub.path)
+        if match and method == sub.method.upper():
+            break
+    else:
+        return {"status": 404, "body": {"detail": f"No batchable route {sub.method} {sub.path}"}}
+    missing = [name for name in required if name not in sub.params]
+    if missing:
+        return {"status": 422, "body": {"detail": f"Missing query parameter {', '.join(missing)}"}}
+    kwargs = match.groupdict()
+    if method != "GET" and sub.idempotency_key:
+        kwargs["idempotency_key"] = sub.idempotency_key
+    try:
+        r = await handler(authorization, sub.params, sub.body, **kwargs)
+    except HTTPException as e:
+        return {"status": e.status_code, "body": {"detail": e.detail}}
+    try:
+        body = r.json()
+    except ValueError:
+        body = r.text
+    return {"status": r.status_code, "body": body}
+
+@app.post("/batch")
+async def batch(payload: BatchIn, request: Request, authorization: str = Header(...)):
+    """
+    Runs several of the routes above in one round trip. The token is
+    verified once for the whole batch, sub-requests run concurrently (at
+    most BATCH_CONCURRENCY at a time) and results come back in request order.
+    Each sub-request costs one request of the caller's quotas, as if it had
+    been sent on its own.
+    """
+    count = len(payload.requests)
+    if count > BATCH_MAX_ITEMS:
+        raise HTTPException(400, f"A batch may hold at most {BATCH_MAX_ITEMS} requests")
+    # RateLimitMiddleware already took one token from the "client" quota.
+    if count > 1:
+        ip = request.client.host if request.client else "unknown"
+        retry_after = rate_limiters["client"].acquire(ip, count - 1)
+        if retry_after:
+            raise too_many_requests(retry_after)
+    if not await verify(authorization, max(count, 1)):
+        raise HTTPException(401, "Invalid token")
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(sub: SubRequest) -> dict:
+        async with semaphore:
+            return await dispatch(sub, authorization)
+
+    return {"responses": await asyncio.gather(*(run(sub) for sub in payload.requests))}
+
+
+LIVE_HEARTBEAT = float(os.getenv("LIVE_HEARTBEAT", 15))
+
+async def calendar_topics(email: str, token: str) -> list[str]:
+    """
+    Anyone signed in may follow a host's slots; booking changes are only
+    pushed to the user they belong to.
+    """
+    authorization = f"Bearer {token}"
+    if not await verify(authorization):
+        raise HTTPException(401, "Invalid token")
+    topics = [slots_topic(email)]
+    if token_email(authorization) == email:
+        topics.append(bookings_topic(email))
+    return topics
+
+@app.websocket("/ws/calendar")
+async def calendar_ws(websocket: WebSocket, email: str, token: str):
+    """
+    Streams slot (and, for your own calendar, booking) deltas as JSON text
+    frames. Browsers cannot set headers on a WebSocket, so the token comes
+    in the query string.
+    """
+    try:
+        topics = await calendar_topics(email, token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscriber = hub.subscribe(topics)
+
+    async def pump():
+        while True:
+            await websocket.send_text(await subscriber.queue.get())
+
+    async def drain():
+        # Notices the client going away; incoming frames are ignored.
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    tasks = [asyncio.create_task(pump()), asyncio.create_task(drain())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        hub.unsubscribe(subscriber)
+
+@app.get("/sse/calendar")
+async def calendar_sse(email: str, token: str, request: Request):
+    """
+    The same deltas as /ws/calendar as Server-Sent Events, with a comment
+    line every LIVE_HEARTBEAT seconds to keep proxies from closing it.
+    """
+    topics = await calendar_topics(email, token)
+    subscriber = hub.subscribe(topics)
+
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), LIVE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {message}\n\n"
+        finally:
+            hub.unsubscribe(subscriber)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,173 @@
+"""
+Circuit breakers, retry budgets, per-route timeouts and latency tracking
+for the façade's upstream calls.
+"""
+import json
+import os
+import time
+
+UPSTREAM_TIMEOUT     = float(os.getenv("UPSTREAM_TIMEOUT", 5))
+BREAKER_FAILURES     = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", 15))
+BREAKER_PROBES       = int(os.getenv("BREAKER_PROBES", 1))
+RETRY_RATIO          = float(os.getenv("RETRY_RATIO", 0.2))
+RETRY_MIN_PER_SECOND = float(os.getenv("RETRY_MIN_PER_SECOND", 5))
+RETRY_BUDGET_CAP     = float(os.getenv("RETRY_BUDGET_CAP", 20))
+HEDGE_PERCENTILE     = float(os.getenv("HEDGE_PERCENTILE", 0))    # 0 disables hedging
+HEDGE_MIN_SAMPLES    = int(os.getenv("HEDGE_MIN_SAMPLES", 50))
+
+# Upper bounds per "METHOD /path" route; anything not listed gets
+# UPSTREAM_TIMEOUT. ROUTE_TIMEOUTS='{"GET /slots": 1.5}' overrides entries.
+ROUTE_TIMEOUTS = {
+    "GET /verify":       2.0,
+    "POST /login":       5.0,
+    "POST /register":    10.0,
+    "GET /slots":        3.0,
+    "GET /slots/search": 5.0,
+    "POST /slots/batch": 15.0,
+    "GET /booking":      3.0,
+}
+ROUTE_TIMEOUTS.update(json.loads(os.getenv("ROUTE_TIMEOUTS", "{}")))
+
+
+def route_timeout(route: str) -> float:
+    return ROUTE_TIMEOUTS.get(route, UPSTREAM_TIMEOUT)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after BREAKER_FAILURES consecutive failures, rejects calls for
+    BREAKER_OPEN_SECONDS, then lets BREAKER_PROBES calls through at a time
+    (half-open). A successful probe closes it, a failed one re-opens it.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self):
+        self.state     = self.CLOSED
+        self.failures  = 0
+        self.opened_at = 0.0
+        self.probes    = 0
+        self.rejected  = 0
+
+    def acquire(self) -> bool:
+        """
+        Returns True when the admitted call is a half-open probe and raises
+        CircuitOpen when the call must not be made.
+        """
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS:
+            self.state = self.HALF_OPEN
+            self.probes = 0
+        if self.state == self.CLOSED:
+            return False
+        if self.state == self.HALF_OPEN and self.probes < BREAKER_PROBES:
+            self.probes += 1
+            return True
+        self.rejected += 1
+        raise CircuitOpen()
+
+    def record(self, ok: bool, probe: bool):
+        if probe:
+            self.probes -= 1
+            if ok:
+                self.state = self.CLOSED
+                self.failures = 0
+            else:
+                self._open()
+            return
+        if ok:
+            self.failures = 0
+        elif self.state == self.CLOSED:
+            self.failures += 1
+            if self.failures >= BREAKER_FAILURES:
+                self._open()
+
+    def release(self, probe: bool):
+        # The call was abandoned before it produced an outcome.
+        if probe:
+            self.probes -= 1
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.failures = 0
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+
+
+class RetryBudget:
+    """
+    Every request earns RETRY_RATIO of a retry and the budget also refills
+    at RETRY_MIN_PER_SECOND, so retries stay a bounded fraction of traffic
+    and cannot snowball while an upstream is struggling.
+    """
+    def __init__(self):
+        self.balance    = RETRY_BUDGET_CAP
+        self.updated_at = time.monotonic()
+        self.requests   = 0
+        self.retries    = 0
+        self.hedges     = 0
+        self.denied     = 0
+
+    def deposit(self):
+        self.requests += 1
+        self._refill(RETRY_RATIO)
+
+    def withdraw(self) -> bool:
+        self._refill(0)
+        if self.balance < 1:
+            self.denied += 1
+            return False
+        self.balance -= 1
+        return True
+
+    def _refill(self, amount: float):
+        now = time.monotonic()
+        amount += (now - self.updated_at) * RETRY_MIN_PER_SECOND
+        self.balance = min(RETRY_BUDGET_CAP, self.balance + amount)
+        self.updated_at = now
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries":  self.retries,
+            "hedges":   self.hedges,
+            "denied":   self.denied,
+            "balance":  round(self.balance, 2),
+        }
+
+
+class LatencyTracker:
+    """
+    Keeps the last `size` latencies of a route to answer percentile queries;
+    the percentile is recomputed every `refresh` samples, not on every call.
+    """
+    def __init__(self, size: int = 512, refresh: int = 32):
+        self.samples: list[float] = []
+        self.size    = size
+        self.refresh = refresh
+        self.next    = 0
+        self.seen    = 0
+        self._cached: dict[float, float] = {}
+
+    def add(self, latency: float):
+        if len(self.samples) < self.size:
+            self.samples.append(latency)
+        else:
+            self.samples[self.next] = latency
+            self.next = (self.next + 1) % self.size
+        self.seen += 1
+        if self.seen % self.refresh == 0:
+            self._cached.clear()
+
+    def percentile(self, p: float) -> float | None:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        if p not in self._cached:
+            ordered = sorted(self.samples)
+            self._cached[p] = ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+        return self._cached[p]
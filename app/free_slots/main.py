@@ -4,6 +4,8 @@ from app.models.time_slots import TimeSlotIn, TimeSlotOut
 import uuid, os, asyncio
 import aioboto3
 from dotenv import load_dotenv, find_dotenv
+from app.free_slots.view import FreeTimeView, UserSlots, start_consumer
+from app.slots.events import current_sequence, get_dynamo_sequences
 import consul
 import socket
 
@@ -22,6 +24,8 @@ SERVICE_PORT = int(os.getenv("SERVICE_PORT", 8005))
 
 consul_client = consul.Consul(host=CONSUL_HOST, port=CONSUL_PORT)
 
+view = FreeTimeView()
+
 @app.on_event("startup")
 async def startup():
     svc_addr = socket.gethostname()
@@ -38,6 +42,7 @@ async def startup():
         )
     )
     app.state.consul_service_id = svc_id
+    start_consumer(view, asyncio.get_running_loop())
 
 @app.on_event("shutdown")
 async def shutdown():
@@ -66,26 +71,50 @@ async def get_dynamo():
       yield table
 
 
+async def load_user(user_email: str, table, seq_table) -> UserSlots:
+    cached = view.get(user_email)
+    if cached is not None:
+        return cached
+    generation = view.generation
+    # Buffer first, sequence second, slots third: events published while
+    # we read are replayed by put(), and anything newer than `seq` that the
+    # query already saw is applied again harmlessly (events are keyed by slot_id).
+    buffer = view.begin_load(user_email)
+    try:
+        seq = await current_sequence(seq_table, user_email)
+        items = []
+        kwargs = {
+            "KeyConditionExpression":    "userEmail = :u",
+            "ExpressionAttributeValues": {":u": user_email},
+        }
+        while True:
+            resp = await table.query(**kwargs)
+            items.extend(resp.get("Items", []))
+            if "LastEvaluatedKey" not in resp:
+                break
+            kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+        user = UserSlots(seq, items)
+        view.put(user_email, user, generation, buffer)
+    finally:
+        view.end_load(user_email, buffer)
+    return view.get(user_email) or user
+
+
 @app.get("/free-slots", response_model=list[TimeSlotOut])
 async def get_free_slots(
     time_interval: TimeSlotIn,
     user_email: str = Depends(get_current_user_email),
     table = Depends(get_dynamo),
+    seq_table = Depends(get_dynamo_sequences),
 ):
     req_start = time_interval.start_time
     req_end = time_interval.end_time
 
-    resp = await table.query(
-        KeyConditionExpression="userEmail = :u",
-        ExpressionAttributeValues={":u": user_email}
-    )
+    user = await load_user(user_email, table, seq_table)
 
-    booked_slots = [
-        TimeSlotIn(start_time=i["startTime"], end_time=i["endTime"])
-        for i in resp.get("Items", [])
-        if i["endTime"] > req_start and i["startTime"] < req_end
-    ]
-    booked_slots.sort(key=lambda x: x.start_time)
+    # Already sorted by start; boundaries are compared as epoch seconds so
+    # mixed offsets ("Z" vs "+02:00") order correctly.
+    booked_slots = user.overlapping(time_interval.start_epoch, time_interval.end_epoch)
 
     free_slots: list[TimeSlotOut] = []
 
@@ -100,31 +129,31 @@ async def get_free_slots(
         return free_slots
 
     first = booked_slots[0]
-    if req_start < first.start_time:
+    if time_interval.start_epoch < first[0]:
         free_slots.append(
             TimeSlotOut(
                 slot_id=str(uuid.uuid4()),
                 start_time=req_start,
-                end_time=first.start_time,
+                end_time=first[3],
             )
         )
 
     for prev, curr in zip(booked_slots, booked_slots[1:]):
-        if prev.end_time < curr.start_time:
+        if prev[1] < curr[0]:
             free_slots.append(
                 TimeSlotOut(
                     slot_id=str(uuid.uuid4()),
-                    start_time=prev.end_time,
-                    end_time=curr.start_time,
+                    start_time=prev[4],
+                    end_time=curr[3],
                 )
             )
 
     last = booked_slots[-1]
-    if last.end_time < req_end:
+    if last[1] < time_interval.end_epoch:
         free_slots.append(
             TimeSlotOut(
                 slot_id=str(uuid.uuid4()),
-                start_time=last.end_time,
+                start_time=last[4],
                 end_time=req_end,
             )
         )
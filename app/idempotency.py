@@ -0,0 +1,258 @@
+"""
+Idempotency-Key support for mutating endpoints.
+
+IdempotencyMiddleware remembers the first successful (2xx) response to a
+request carrying an `Idempotency-Key` header and replays it for retries of
+that request without running the endpoint again. A duplicate arriving
+while the first one is still running waits for it instead of racing it.
+
+Keys are scoped by caller (Authorization header), method and path, and are
+bound to the request body: reusing a key for a different body is a 422.
+Responses live in a bounded in-memory LRU for IDEMPOTENCY_TTL seconds.
+When IDEMPOTENCY_TABLE is set, they are also stored in DynamoDB with a
+pending marker while the request runs, so the guarantee holds across
+replicas.
+
+The façade image copies this module next to its own main.py.
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+IDEMPOTENCY_TTL      = int(os.getenv("IDEMPOTENCY_TTL", 24 * 3600))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", 10_000))
+IDEMPOTENCY_TABLE    = os.getenv("IDEMPOTENCY_TABLE")
+IDEMPOTENCY_WAIT     = float(os.getenv("IDEMPOTENCY_WAIT", 10))
+# A pending claim only lives this long, so a replica that dies mid-request
+# blocks retries of the key for a short while instead of a whole TTL.
+IDEMPOTENCY_LEASE    = float(os.getenv("IDEMPOTENCY_LEASE", 3 * IDEMPOTENCY_WAIT))
+AWS_REGION           = os.getenv("AWS_REGION", "eu-west-1")
+DYNAMODB_ENDPOINT    = os.getenv("DYNAMODB_ENDPOINT", "http://dynamodb-local:8000")
+
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class StoredResponse:
+    def __init__(self, fingerprint: str, status: int, headers: list, body: bytes):
+        self.fingerprint = fingerprint
+        self.status      = status
+        self.headers     = headers
+        self.body        = body
+        self.expires_at  = time.time() + IDEMPOTENCY_TTL
+
+
+class MemoryStore:
+    def __init__(self, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.max_keys = max_keys
+        self.entries: OrderedDict[str, StoredResponse] = OrderedDict()
+
+    def get(self, key: str) -> StoredResponse | None:
+        self._evict()
+        return self.entries.get(key)
+
+    def put(self, key: str, response: StoredResponse):
+        self.entries[key] = response
+        self.entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        # Every entry lives IDEMPOTENCY_TTL from insertion, so the oldest
+        # one is always at the front.
+        now = time.time()
+        while self.entries:
+            key, oldest = next(iter(self.entries.items()))
+            if oldest.expires_at > now and len(self.entries) <= self.max_keys:
+                break
+            del self.entries[key]
+
+
+class DynamoStore:
+    """
+    Shared store for several replicas. An item is written as `pending`
+    with a conditional put before the request runs and completed with the
+    response afterwards; DynamoDB TTL on expiresAt cleans it up. A pending
+    item expires after IDEMPOTENCY_LEASE and can then be claimed again;
+    only a completed one is kept for IDEMPOTENCY_TTL.
+    """
+    PENDING, DONE = "pending", "done"
+
+    def __init__(self, table_name: str):
+        import aioboto3
+        self.table_name = table_name
+        self.session = aioboto3.Session()
+
+    @contextlib.asynccontextmanager
+    async def _table(self):
+        async with self.session.resource("dynamodb", region_name=AWS_REGION, endpoint_url=DYNAMODB_ENDPOINT) as dynamo:
+            yield await dynamo.Table(self.table_name)
+
+    async def claim(self, key: str, fingerprint: str) -> dict | None:
+        """
+        Returns None when this replica now owns the key, otherwise the
+        existing item (pending or done).
+        """
+        from botocore.exceptions import ClientError
+        async with self._table() as table:
+            while True:
+                now = int(time.time())
+                try:
+                    await table.put_item(
+                        Item={"idempotencyKey": key, "state": self.PENDING, "fingerprint": fingerprint,
+                              "expiresAt": now + int(IDEMPOTENCY_LEASE)},
+                        ConditionExpression="attribute_not_exists(idempotencyKey) OR expiresAt < :now",
+                        ExpressionAttributeValues={":now": now},
+                    )
+                    return None
+                except ClientError as e:
+                    if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                        raise
+                resp = await table.get_item(Key={"idempotencyKey": key}, ConsistentRead=True)
+                # Released between the put and the get: try again.
+                if "Item" in resp:
+                    return resp["Item"]
+
+    async def wait(self, key: str) -> dict | None:
+        """
+        Waits for another replica's pending item. Returns the completed
+        item, None once the key can be claimed again (released, or its
+        lease ran out), or the still-pending item after IDEMPOTENCY_WAIT.
+        """
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT
+        async with self._table() as table:
+            while True:
+                await asyncio.sleep(0.1)
+                resp = await table.get_item(Key={"idempotencyKey": key}, ConsistentRead=True)
+                item = resp.get("Item")
+                if item is None or item["state"] == self.DONE:
+                    return item
+                if int(item["expiresAt"]) < time.time():
+                    return None
+                if time.monotonic() >= deadline:
+                    return item
+
+    async def complete(self, key: str, response: StoredResponse):
+        async with self._table() as table:
+            await table.put_item(Item={
+                "idempotencyKey": key,
+                "state":          self.DONE,
+                "fingerprint":    response.fingerprint,
+                "status":         response.status,
+                "headers":        json.dumps([[k.decode("latin-1"), v.decode("latin-1")] for k, v in response.headers]),
+                "body":           response.body,
+                "expiresAt":      int(response.expires_at),
+            })
+
+    async def release(self, key: str):
+        async with self._table() as table:
+            await table.delete_item(Key={"idempotencyKey": key})
+
+    @staticmethod
+    def to_response(item: dict) -> StoredResponse:
+        headers = [[k.encode("latin-1"), v.encode("latin-1")] for k, v in json.loads(item["headers"])]
+        body = item["body"]
+        return StoredResponse(item["fingerprint"], int(item["status"]), headers,
+                              body.value if hasattr(body, "value") else bytes(body))
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app, table_name: str | None = IDEMPOTENCY_TABLE):
+        self.app = app
+        self.memory = MemoryStore()
+        self.shared = DynamoStore(table_name) if table_name else None
+        self.inflight: dict[str, asyncio.Future] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in MUTATING_METHODS:
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(b"idempotency-key")
+        if not idempotency_key:
+            return await self.app(scope, receive, send)
+
+        messages, body = [], b""
+        while True:
+            message = await receive()
+            messages.append(message)
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        fingerprint = hashlib.sha256(body).hexdigest()
+        key = hashlib.sha256(b"\0".join([
+            headers.get(b"authorization", b""), scope["method"].encode(),
+            scope["path"].encode(), idempotency_key,
+        ])).hexdigest()
+
+        async def replay_receive():
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        while True:
+            stored = self.memory.get(key)
+            if stored is not None:
+                return await self._replay(stored, fingerprint, send)
+            if key not in self.inflight:
+                break
+            # Same key already running here: wait for it, then look again.
+            await asyncio.shield(self.inflight[key])
+
+        done = asyncio.get_running_loop().create_future()
+        self.inflight[key] = done
+        try:
+            if self.shared is not None:
+                item = await self.shared.claim(key, fingerprint)
+                while item is not None and item["state"] == DynamoStore.PENDING:
+                    item = await self.shared.wait(key)
+                    if item is None:
+                        item = await self.shared.claim(key, fingerprint)
+                    elif item["state"] == DynamoStore.PENDING:
+                        return await self._send(send, 409, {"detail": "A request with this Idempotency-Key is still in progress"})
+                if item is not None:
+                    stored = DynamoStore.to_response(item)
+                    self.memory.put(key, stored)
+                    return await self._replay(stored, fingerprint, send)
+
+            status, response_headers, chunks = None, [], []
+
+            async def capture_send(message):
+                nonlocal status, response_headers
+                if message["type"] == "http.response.start":
+                    status, response_headers = message["status"], message.get("headers", [])
+                elif message["type"] == "http.response.body":
+                    chunks.append(message.get("body", b""))
+                await send(message)
+
+            try:
+                await self.app(scope, replay_receive, capture_send)
+            except BaseException:
+                if self.shared is not None:
+                    await self.shared.release(key)
+                raise
+
+            if status is not None and 200 <= status < 300:
+                stored = StoredResponse(fingerprint, status, list(response_headers), b"".join(chunks))
+                self.memory.put(key, stored)
+                if self.shared is not None:
+                    await self.shared.complete(key, stored)
+            elif self.shared is not None:
+                await self.shared.release(key)
+        finally:
+            del self.inflight[key]
+            done.set_result(None)
+
+    async def _replay(self, stored: StoredResponse, fingerprint: str, send):
+        if stored.fingerprint != fingerprint:
+            return await self._send(send, 422, {"detail": "Idempotency-Key was already used for a different request"})
+        await send({"type": "http.response.start", "status": stored.status,
+                    "headers": stored.headers + [[b"idempotent-replayed", b"true"]]})
+        await send({"type": "http.response.body", "body": stored.body})
+
+    @staticmethod
+    async def _send(send, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [[b"content-type", b"application/json"],
+                                [b"content-length", str(len(body)).encode()]]})
+        await send({"type": "http.response.body", "body": body})
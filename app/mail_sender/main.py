@@ -30,6 +30,11 @@ ch.queue_bind(
   queue="messages",
   routing_key="user.registered"
 )
+ch.queue_bind(
+  exchange="events",
+  queue="messages",
+  routing_key="booking.created"
+)
 
 ses = boto3.client("ses", region_name=os.getenv("AWS_REGION", "eu-west-1"))
 
@@ -46,15 +51,20 @@ def send_email(to: str, subject: str, body: str):
 
 def on_message(ch, method, props, body):
     print("RECEIVED MESSAGE")
-    evt = json.loads(body)
     rk  = method.routing_key
     print(rk)
     try:
+        evt = json.loads(body)
         if rk == "user.registered":
             handle_registration(evt)
+        elif rk == "booking.created":
+            handle_booking(evt)
         ch.basic_ack(delivery_tag=method.delivery_tag)
     except Exception as e:
         print("❌ NotificationService error:", e)
+        # Never leave a message unacked: with prefetch_count=1 it would
+        # stall every mail behind it.
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
 
 
 def handle_registration(evt):
@@ -65,6 +75,20 @@ def handle_registration(evt):
         body=f"Hi {user['name']}, thanks for signing up!"
     )
 
+def handle_booking(evt):
+    # Participant addresses come from the client; one that SES rejects
+    # must not cost the others their mail.
+    for participant in evt["participants"]:
+        try:
+            send_email(
+                to=participant,
+                subject="You have a new meeting",
+                body=f"{evt['creator_email']} booked a meeting with you: "
+                     f"{evt['start_time']} - {evt['end_time']}."
+            )
+        except Exception as e:
+            print(f"❌ Could not mail {participant}:", e)
+
 if __name__ == "__main__":
     print("🟢 Mail‑sender connected to RabbitMQ, bound to queue 'messages'")
     ch.basic_qos(prefetch_count=1)
@@ -1,13 +1,93 @@
-from pydantic import BaseModel, Field
-from datetime import datetime
+from pydantic import BaseModel, Field, field_validator
+from datetime import datetime, timezone
+from typing import List, Optional
+import os
+
+# Past slots stay visible this long after they end; then DynamoDB TTL
+# removes them through the expiresAt attribute.
+SLOT_RETENTION = int(os.getenv("SLOT_RETENTION", 7 * 24 * 3600))
+
+
+def to_epoch(value: str) -> int:
+    """
+    ISO 8601 string -> integer epoch seconds. Times without an offset are
+    taken as UTC.
+    """
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def item_epochs(item: dict) -> tuple[int, int]:
+    """
+    (startEpoch, endEpoch) of a stored slot or reservation; computed from
+    the strings for items written before epochs were stored.
+    """
+    if "startEpoch" in item and "endEpoch" in item:
+        return int(item["startEpoch"]), int(item["endEpoch"])
+    return to_epoch(item["startTime"]), to_epoch(item["endTime"])
+
+def day_bucket(epoch: int) -> str:
+    """
+    UTC day a slot starts on ("YYYY-MM-DD"): the partition key of the
+    cross-host availability index.
+    """
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).date().isoformat()
+
+def slot_expiry(end_epoch: int) -> int:
+    """TTL (expiresAt, epoch seconds) of a slot ending at end_epoch."""
+    return end_epoch + SLOT_RETENTION
 
 class TimeSlot(BaseModel):
     start_time: datetime = Field(..., example="2025-04-20T13:00:00Z")
     end_time: datetime = Field(..., example="2025-04-20T14:00:00Z")
 
-class TimeSlotIn(BaseModel): # store according to ISO 8601
+class TimeSlotIn(BaseModel): # store according to ISO 8601, compare as epoch seconds
     start_time: str = Field(..., example="2025-04-20T13:00:00Z")
     end_time:   str = Field(..., example="2025-04-20T14:00:00Z")
 
+    @field_validator("start_time", "end_time")
+    @classmethod
+    def iso_8601(cls, value: str) -> str:
+        to_epoch(value)
+        return value
+
+    @property
+    def start_epoch(self) -> int:
+        return to_epoch(self.start_time)
+
+    @property
+    def end_epoch(self) -> int:
+        return to_epoch(self.end_time)
+
 class TimeSlotOut(TimeSlotIn):
-    slot_id: str
\ No newline at end of file
+    slot_id: str
+
+class RecurrenceIn(BaseModel): # RRULE-like: FREQ, INTERVAL, COUNT or UNTIL, EXDATE
+    start_time: str = Field(..., example="2025-09-01T13:00:00Z")
+    end_time:   str = Field(..., example="2025-09-01T14:00:00Z")
+    freq:       str = Field("WEEKLY", example="WEEKLY")
+    interval:   int = Field(1, example=1)
+    count:      Optional[int] = Field(None, example=15)
+    until:      Optional[str] = Field(None, example="2025-12-20")
+    exdates:    List[str] = Field([], example=["2025-10-27"])
+
+class SlotBatchIn(BaseModel):
+    slots:      List[TimeSlotIn] = []
+    recurrence: Optional[RecurrenceIn] = None
+
+class SlotConflict(TimeSlotIn):
+    reason: str
+
+class SlotBatchOut(BaseModel):
+    created:   List[TimeSlotOut]
+    conflicts: List[SlotConflict]
+
+
+class HostSlotOut(TimeSlotOut):
+    user_email: str
+
+class SlotSearchOut(BaseModel):
+    slots:  List[HostSlotOut]
+    cursor: Optional[str] = None   # pass back to get the next page
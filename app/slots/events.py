@@ -0,0 +1,55 @@
+"""
+`slot.*` change events on the `events` exchange.
+
+Every event carries a per-user sequence number taken from the SlotSequences
+table, so consumers that keep derived state (free_slots) can tell when they
+missed something and rebuild that user from DynamoDB.
+"""
+import asyncio
+import os
+import aioboto3
+from app.rabbit_listener.publisher import publisher
+
+AWS_REGION        = os.getenv("AWS_REGION", "eu-west-1")
+DYNAMODB_ENDPOINT = os.getenv("DYNAMODB_ENDPOINT", "http://dynamodb-local:8000")
+SEQUENCES_TABLE   = os.getenv("SEQUENCES_TABLE", "SlotSequences")
+
+
+async def get_dynamo_sequences():
+    session = aioboto3.Session()
+    async with session.resource("dynamodb", region_name=AWS_REGION, endpoint_url=DYNAMODB_ENDPOINT) as dynamo:
+      table = await dynamo.Table(SEQUENCES_TABLE)
+      yield table
+
+
+async def current_sequence(seq_table, user_email: str) -> int:
+    resp = await seq_table.get_item(Key={"userEmail": user_email}, ConsistentRead=True)
+    return int(resp.get("Item", {}).get("seq", 0))
+
+
+async def publish_slot_event(seq_table, kind: str, user_email: str, slots: list[dict]):
+    """
+    Publishes `slot.<kind>` (created, deleted or booked) for slots of one
+    user, after the change is already in DynamoDB. Each slot is a dict with
+    slot_id and, for created, start_time/end_time.
+
+    Publishing fails fast (see Publisher) so a broker outage never holds up
+    the write it reports. A failed publish is only logged: the sequence
+    number is already used, so consumers see a gap with the next event and
+    resynchronise.
+    """
+    resp = await seq_table.update_item(
+        Key={"userEmail": user_email},
+        UpdateExpression="ADD seq :one",
+        ExpressionAttributeValues={":one": 1},
+        ReturnValues="UPDATED_NEW",
+    )
+    event = {
+        "user_email": user_email,
+        "seq":        int(resp["Attributes"]["seq"]),
+        "slots":      slots,
+    }
+    try:
+        await asyncio.to_thread(publisher.publish, f"slot.{kind}", event)
+    except Exception as e:
+        print(f"❌ Could not publish slot.{kind}:", e)
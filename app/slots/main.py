@@ -1,18 +1,21 @@
+import base64
 import datetime
+import json
 from fastapi import FastAPI, Header, HTTPException, Depends, Query
-from app.models.time_slots import TimeSlotIn, TimeSlotOut
+from app.models.time_slots import (TimeSlotIn, TimeSlotOut, SlotBatchIn, SlotBatchOut, HostSlotOut,
+                                   SlotSearchOut, day_bucket, slot_expiry, to_epoch)
+from app.slots.events import get_dynamo_sequences, publish_slot_event
+from app.slots.recurrence import MAX_OCCURRENCES, expand_recurrence, find_conflicts
+from app.idempotency import IdempotencyMiddleware
 import uuid, os, asyncio
 import aioboto3
 from dotenv import load_dotenv, find_dotenv
 from app.database import database
 from app.models.user import revoked_tokens
+from boto3.dynamodb.conditions import Attr, Key
 import consul
 import socket
-from pydantic import BaseModel
-from pydantic import Field
-from typing import List
 from fastapi import Body
-from boto3.dynamodb.conditions import Key
 
 load_dotenv(find_dotenv())
 
@@ -21,6 +24,7 @@ TABLE_NAME = os.getenv("SLOTS_TABLE", "TimeSlots")
 DYNAMODB_ENDPOINT = os.getenv("DYNAMODB_ENDPOINT", "http://dynamodb-local:8000")
 
 app = FastAPI(title="TimeSlot Service")
+app.add_middleware(IdempotencyMiddleware)
 
 CONSUL_HOST  = os.getenv("CONSUL_HOST", "consul")
 CONSUL_PORT  = int(os.getenv("CONSUL_PORT", 8500))
@@ -29,29 +33,6 @@ SERVICE_PORT = int(os.getenv("SERVICE_PORT", 8007))
 
 consul_client = consul.Consul(host=CONSUL_HOST, port=CONSUL_PORT)
 
-class BookingIn(BaseModel):
-    timeslot:     TimeSlotIn
-    participants: List[str] = Field(..., example=["alice@example.com", "bob@example.com"])
-
-class BookingOut(BaseModel):
-    slot_id: str
-    user_email: str
-    start_time: str
-    end_time: str
-    participants: List[str]
-
-async def get_dynamo_slots():
-    session = aioboto3.Session()
-    async with session.resource("dynamodb", region_name=AWS_REGION, endpoint_url=DYNAMODB_ENDPOINT) as dynamo:
-      table = await dynamo.Table("TimeSlots")
-      yield table
-
-async def get_dynamo_reservations():
-    session = aioboto3.Session()
-    async with session.resource("dynamodb", region_name=AWS_REGION, endpoint_url=DYNAMODB_ENDPOINT) as dynamo:
-      table = await dynamo.Table("Reservations")
-      yield table
-
 @app.on_event("startup")
 async def startup():
     svc_addr = socket.gethostname()
@@ -100,47 +81,131 @@ async def get_dynamo():
       table = await dynamo.Table("TimeSlots")
       yield table
 
-class TimeSlotBody(BaseModel):
-    start_time: str
-    end_time: str
+SLOTS_BY_START = "userStart"   # GSI: userEmail + startEpoch
+SLOTS_BY_DAY   = "byDay"       # GSI: dayBucket + startEpoch, across all hosts
+
+# A slot is filed under the day it starts on, so a search also looks this
+# far back for slots that started earlier and run into the window.
+SEARCH_LOOKBACK = int(os.getenv("SEARCH_LOOKBACK", 24 * 3600))
+SEARCH_MAX_DAYS = int(os.getenv("SEARCH_MAX_DAYS", 31))
+SEARCH_PAGE_MAX = 100
+
+def slot_item(user_email: str, slot_id: str, slot: TimeSlotIn) -> dict:
+    return {
+        "userEmail":  user_email,
+        "slotId":     slot_id,
+        "startTime":  slot.start_time,
+        "endTime":    slot.end_time,
+        "startEpoch": slot.start_epoch,
+        "endEpoch":   slot.end_epoch,
+        "dayBucket":  day_bucket(slot.start_epoch),
+        "expiresAt":  slot_expiry(slot.end_epoch),
+    }
+
+async def query_all(table, **kwargs) -> list[dict]:
+    items = []
+    while True:
+        resp = await table.query(**kwargs)
+        items.extend(resp.get("Items", []))
+        if "LastEvaluatedKey" not in resp:
+            return items
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+async def slots_in_window(table, user_email: str, start: int, end: int) -> list[dict]:
+    """
+    The user's slots that overlap [start, end), read through the startEpoch
+    index instead of the whole partition. A user's slots never overlap, so
+    of the slots starting before `start` only the latest one can reach in.
+    The index is a GSI (an LSI cannot be added to an existing table), so
+    reads are eventually consistent: a slot written a moment ago may be
+    missing. The check and the put were never atomic anyway.
+    """
+    before = await table.query(
+        IndexName=SLOTS_BY_START,
+        KeyConditionExpression=Key("userEmail").eq(user_email) & Key("startEpoch").lt(start),
+        ScanIndexForward=False,
+        Limit=1,
+    )
+    inside = await query_all(
+        table,
+        IndexName=SLOTS_BY_START,
+        KeyConditionExpression=Key("userEmail").eq(user_email) & Key("startEpoch").between(start, end - 1),
+    )
+    return [i for i in before.get("Items", []) if i["endEpoch"] > start] + inside
 
 @app.post("/slots", response_model=TimeSlotOut)
 async def create_slot(
-    slot: TimeSlotBody,
+    slot: TimeSlotIn,
     user_email: str = Depends(get_current_user_email),
     table = Depends(get_dynamo),
+    seq_table = Depends(get_dynamo_sequences),
 ):
-    if slot.start_time >= slot.end_time:
+    if slot.start_epoch >= slot.end_epoch:
         raise HTTPException(
             status_code=400,
             detail="The start time must be earlier than the end time."
         )
 
-    resp = await table.query(
-        KeyConditionExpression="userEmail = :u",
-        ExpressionAttributeValues={":u": user_email}
-    )
-
-    for existing_slot in resp.get("Items", []):
-        if not (
-            slot.end_time <= existing_slot["startTime"] or
-            slot.start_time >= existing_slot["endTime"]
-        ):
-            raise HTTPException(
-                status_code=400,
-                detail="The provided time slot overlaps with an existing slot."
-            )
+    if await slots_in_window(table, user_email, slot.start_epoch, slot.end_epoch):
+        raise HTTPException(
+            status_code=400,
+            detail="The provided time slot overlaps with an existing slot."
+        )
 
     slot_id = str(uuid.uuid4())
-    item = {
-        "userEmail":    user_email,
-        "slotId":    slot_id,
-        "startTime": slot.start_time,
-        "endTime":   slot.end_time,
-    }
-    await table.put_item(Item=item)
+    await table.put_item(Item=slot_item(user_email, slot_id, slot))
+    await publish_slot_event(seq_table, "created", user_email, [
+        {"slot_id": slot_id, "start_time": slot.start_time, "end_time": slot.end_time},
+    ])
     return {**slot.dict(), "slot_id": slot_id}
 
+@app.post("/slots/batch", response_model=SlotBatchOut)
+async def create_slots_batch(
+    batch: SlotBatchIn,
+    user_email: str = Depends(get_current_user_email),
+    table = Depends(get_dynamo),
+    seq_table = Depends(get_dynamo_sequences),
+):
+    """
+    Creates many slots at once: explicit ones plus the occurrences of an
+    optional recurrence. All of them are checked against the user's slots
+    in one sorted sweep over the batch's time window and written with
+    BatchWriteItem; slots that cannot
+    be created are reported in `conflicts` instead of failing the request.
+    """
+    candidates = list(batch.slots)
+    if batch.recurrence:
+        try:
+            candidates.extend(expand_recurrence(batch.recurrence))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if not candidates:
+        raise HTTPException(status_code=400, detail="No slots to create.")
+    if len(candidates) > MAX_OCCURRENCES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_OCCURRENCES} slots per request.")
+
+    valid = [c for c in candidates if c.start_epoch < c.end_epoch]
+    existing = []
+    if valid:
+        existing = await slots_in_window(
+            table, user_email,
+            min(c.start_epoch for c in valid),
+            max(c.end_epoch for c in valid),
+        )
+    accepted, conflicts = find_conflicts(candidates, existing)
+
+    created = []
+    # batch_writer sends BatchWriteItem in chunks of 25 and resubmits
+    # unprocessed items.
+    async with table.batch_writer() as writer:
+        for slot in accepted:
+            slot_id = str(uuid.uuid4())
+            await writer.put_item(Item=slot_item(user_email, slot_id, slot))
+            created.append(TimeSlotOut(**slot.dict(), slot_id=slot_id))
+    if created:
+        await publish_slot_event(seq_table, "created", user_email, [c.dict() for c in created])
+    return SlotBatchOut(created=created, conflicts=conflicts)
+
 @app.get("/slots", response_model=list[TimeSlotOut])
 async def list_slots(
     user_email:str,
@@ -159,98 +224,97 @@ async def list_slots(
         ) for i in resp.get("Items", [])
     ]
     
+def encode_cursor(day: str, last_key: dict | None) -> str:
+    key = {k: int(v) if k == "startEpoch" else v for k, v in (last_key or {}).items()}
+    return base64.urlsafe_b64encode(json.dumps({"d": day, "k": key}).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[str, dict | None]:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return state["d"], state["k"] or None
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+@app.get("/slots/search", response_model=SlotSearchOut)
+async def search_slots(
+    start: str = Query(..., alias="from"),
+    end: str = Query(..., alias="to"),
+    min_duration: int = Query(0, ge=0, description="minutes the slot must overlap [from, to)"),
+    limit: int = Query(50, ge=1, le=SEARCH_PAGE_MAX),
+    cursor: str | None = None,
+    table = Depends(get_dynamo),
+):
+    """
+    Open slots of every host that overlap [from, to) by at least
+    `min_duration` minutes, ordered by day and start time. Reads only the
+    day partitions of the byDay index that the window touches; booked and
+    deleted slots leave the index together with the slot item.
+    """
+    try:
+        window_start, window_end = to_epoch(start), to_epoch(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from and to must be ISO 8601 times.")
+    needed = max(min_duration * 60, 1)
+    if window_end - window_start < needed:
+        raise HTTPException(status_code=400, detail="The window is shorter than min_duration.")
+
+    first = datetime.date.fromisoformat(day_bucket(window_start - SEARCH_LOOKBACK))
+    last = datetime.date.fromisoformat(day_bucket(window_end - 1))
+    if (last - first).days > SEARCH_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Search at most {SEARCH_MAX_DAYS} days at a time.")
+    days = [(first + datetime.timedelta(days=n)).isoformat() for n in range((last - first).days + 1)]
+
+    last_key = None
+    if cursor:
+        day, last_key = decode_cursor(cursor)
+        if day not in days:
+            raise HTTPException(status_code=400, detail="Cursor does not belong to this search.")
+        days = days[days.index(day):]
+
+    found: list[HostSlotOut] = []
+    for day in days:
+        while True:
+            # Never read more than the page still has room for, so the
+            # last evaluated key is an exact resume point.
+            kwargs = {
+                "IndexName":              SLOTS_BY_DAY,
+                "KeyConditionExpression": Key("dayBucket").eq(day)
+                                          & Key("startEpoch").between(window_start - SEARCH_LOOKBACK, window_end - needed),
+                "FilterExpression":       Attr("endEpoch").gte(window_start + needed),
+                "Limit":                  limit - len(found),
+            }
+            if last_key:
+                kwargs["ExclusiveStartKey"] = last_key
+            resp = await table.query(**kwargs)
+            for i in resp.get("Items", []):
+                overlap = min(int(i["endEpoch"]), window_end) - max(int(i["startEpoch"]), window_start)
+                if overlap >= needed:
+                    found.append(HostSlotOut(
+                        user_email=i["userEmail"],
+                        slot_id=i["slotId"],
+                        start_time=i["startTime"],
+                        end_time=i["endTime"],
+                    ))
+            last_key = resp.get("LastEvaluatedKey")
+            if len(found) >= limit:
+                next_cursor = None
+                if last_key:
+                    next_cursor = encode_cursor(day, last_key)
+                elif day != days[-1]:
+                    next_cursor = encode_cursor(days[days.index(day) + 1], None)
+                return SlotSearchOut(slots=found, cursor=next_cursor)
+            if not last_key:
+                break
+    return SlotSearchOut(slots=found)
 
 @app.delete("/slots/{slot_id}")
 async def delete_slot(
     slot_id: str,
     user_email: str = Depends(get_current_user_email),
     table = Depends(get_dynamo),
+    seq_table = Depends(get_dynamo_sequences),
 ):
     await table.delete_item(Key={"userEmail": user_email, "slotId": slot_id})
+    await publish_slot_event(seq_table, "deleted", user_email, [{"slot_id": slot_id}])
     return {"deleted": slot_id}
 
-
-class BookingResponse(BaseModel):
-    success: bool
-
-
-@app.post("/booking", response_model=BookingResponse)
-async def create_booking(
-    data: dict,
-    current_user_email: str = Depends(get_current_user_email),
-    reservations_table = Depends(get_dynamo_reservations),
-    slot_table = Depends(get_dynamo),
-):
-    print("Input book", data["slot_id"])
-
-    resp = await slot_table.query(
-        KeyConditionExpression="userEmail = :u",
-        ExpressionAttributeValues={":u": data["host_email"]}
-    )
-    slot_found = None
-    for i in resp.get("Items", []):
-        if i["slotId"] == data["slot_id"]:
-            slot_found = i
-    
-    slot_id = data["slot_id"]
-    
-    for participant in data["participants"]:
-        item={
-            "participantEmail": participant,
-            "creatorEmail":     current_user_email,
-            "slotId":           slot_id,
-            "startTime":        slot_found["startTime"],
-            "endTime":          slot_found["endTime"],
-        }
-        await reservations_table.put_item(Item=item)
-    
-    await reservations_table.put_item(Item={
-        "participantEmail": current_user_email,
-        "creatorEmail":     current_user_email,
-        "slotId":           slot_id,
-        "startTime":        slot_found["startTime"],
-        "endTime":          slot_found["endTime"],
-    })
-    
-    await slot_table.delete_item(Key={"userEmail": data["host_email"], "slotId": slot_id})
-
-    return BookingResponse(success = True)
-
-
-@app.get("/booking", response_model=list[BookingOut])
-async def list_bookings(
-    current_user_email: str = Depends(get_current_user_email),
-    reservations_table = Depends(get_dynamo_reservations),
-):
-    print("Booking request here")
-    resp = await reservations_table.query(
-        KeyConditionExpression=Key("participantEmail").eq(current_user_email)
-    )
-    items = resp.get("Items", [])
-
-    slots_map = {}
-    for it in items:
-        sid = it["slotId"]
-        if sid not in slots_map:
-            slots_map[sid] = {
-                "slot_id":    sid,
-                "user_email": it["creatorEmail"],
-                "start_time": it["startTime"],
-                "end_time":   it["endTime"],
-                "participants": set(),
-            }
-        slots_map[sid]["participants"].add(it["participantEmail"])
-
-    result = []
-    for data in slots_map.values():
-        result.append(
-            BookingOut(
-                slot_id=data["slot_id"],
-                user_email=data["user_email"],
-                start_time=data["start_time"],
-                end_time=data["end_time"],
-                participants=list(data["participants"]),
-            )
-        )
-
-    return result
\ No newline at end of file
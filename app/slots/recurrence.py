@@ -0,0 +1,103 @@
+"""
+Expansion of recurring slots and overlap checks for bulk slot creation.
+"""
+import re
+from datetime import datetime, timedelta, timezone
+
+from app.models.time_slots import RecurrenceIn, SlotConflict, TimeSlotIn, item_epochs
+
+MAX_OCCURRENCES = 500
+
+FREQUENCIES = {
+    "DAILY":  timedelta(days=1),
+    "WEEKLY": timedelta(weeks=1),
+}
+
+_NO_SECONDS = re.compile(r"^\d{4}-\d\d-\d\dT\d\d:\d\d(Z|[+-]\d\d:\d\d)?$")
+
+
+def _parse(value: str) -> datetime:
+    # Like to_epoch: a time without an offset is UTC, so naive and aware
+    # times in one rule can be compared.
+    dt = datetime.fromisoformat(value)
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def _format_like(dt: datetime, sample: str) -> str:
+    # Occurrences keep the client's spelling of the first one.
+    if datetime.fromisoformat(sample).tzinfo is None:
+        dt = dt.replace(tzinfo=None)
+    text = dt.isoformat(timespec="minutes" if _NO_SECONDS.match(sample) else "seconds")
+    if sample.endswith("Z"):
+        text = text.replace("+00:00", "Z")
+    return text
+
+
+def expand_recurrence(rule: RecurrenceIn) -> list[TimeSlotIn]:
+    """
+    Returns every occurrence of the rule, first one included, minus the
+    exception dates. Raises ValueError for rules that cannot be expanded.
+    """
+    if rule.freq.upper() not in FREQUENCIES:
+        raise ValueError(f"freq must be one of {sorted(FREQUENCIES)}")
+    if rule.interval < 1:
+        raise ValueError("interval must be at least 1")
+    if rule.count is None and rule.until is None:
+        raise ValueError("A recurrence needs either count or until")
+
+    start = _parse(rule.start_time)
+    end = _parse(rule.end_time)
+    if start >= end:
+        raise ValueError("The start time must be earlier than the end time.")
+    step = FREQUENCIES[rule.freq.upper()] * rule.interval
+
+    until_date = datetime.fromisoformat(rule.until[:10]).date() if rule.until else None
+    skipped = {exdate[:10] for exdate in rule.exdates}
+
+    occurrences = []
+    for n in range(MAX_OCCURRENCES + 1):
+        if rule.count is not None and n >= rule.count:
+            break
+        current = start + step * n
+        if until_date and current.date() > until_date:
+            break
+        if n == MAX_OCCURRENCES:
+            raise ValueError(f"A recurrence may expand to at most {MAX_OCCURRENCES} slots")
+        if current.date().isoformat() in skipped:
+            continue
+        occurrences.append(TimeSlotIn(
+            start_time=_format_like(current, rule.start_time),
+            end_time=_format_like(current + (end - start), rule.end_time),
+        ))
+    return occurrences
+
+
+def find_conflicts(candidates: list[TimeSlotIn], existing: list[dict]) -> tuple[list[TimeSlotIn], list[SlotConflict]]:
+    """
+    Splits candidates into the ones that can be created and the ones that
+    cannot, in a single sweep over both lists sorted by start time. Existing
+    slots never overlap each other, so sorted by start they are sorted by
+    end too and one pointer into them is enough.
+    """
+    booked = sorted(item_epochs(item) for item in existing)
+    accepted: list[TimeSlotIn] = []
+    conflicts: list[SlotConflict] = []
+
+    j = 0
+    accepted_end = None
+    for slot in sorted(candidates, key=lambda s: s.start_epoch):
+        start, end = slot.start_epoch, slot.end_epoch
+        if start >= end:
+            conflicts.append(SlotConflict(**slot.dict(), reason="The start time must be earlier than the end time."))
+            continue
+        while j < len(booked) and booked[j][1] <= start:
+            j += 1
+        if j < len(booked) and booked[j][0] < end:
+            conflicts.append(SlotConflict(**slot.dict(), reason="Overlaps with an existing slot."))
+            continue
+        if accepted_end is not None and start < accepted_end:
+            conflicts.append(SlotConflict(**slot.dict(), reason="Overlaps with another slot in this request."))
+            continue
+        accepted.append(slot)
+        accepted_end = end
+    return accepted, conflicts
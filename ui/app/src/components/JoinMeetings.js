@@ -68,7 +68,7 @@ const JoinMeetings = () => {
       alert('Slot booked successfully!');
       setSelectedSlot(null);
     } catch (err) {
-      setError('Failed to book slot. Please try again.');
+      setError(err.response?.data?.detail || 'Failed to book slot. Please try again.');
     }
   };
 
@@ -11,43 +11,75 @@ const MySlots = () => {
   const [error, setError] = useState('');
   const [newSlot, setNewSlot] = useState({ start_time: '', end_time: '' });
 
-  // Fetch slots
-  useEffect(() => {
-    const fetchSlots = async () => {
-      try {
-        const res = await axios.get(`${API_URL}/slots?email=${localStorage.getItem('email')}`, {
+  // Fetch slots and bookings in one round trip
+  const fetchDashboard = async () => {
+    try {
+      const res = await axios.post(
+        `${API_URL}/batch`,
+        {
+          requests: [
+            { method: 'GET', path: '/slots', params: { email: localStorage.getItem('email') } },
+            { method: 'GET', path: '/bookings' },
+          ],
+        },
+        {
           headers: {
             Authorization: `Bearer ${localStorage.getItem('token')}`,
           },
-        });
-        setSlots(res.data);
-      } catch (err) {
+        }
+      );
+      const [slotsRes, bookingsRes] = res.data.responses;
+      if (slotsRes.status === 200) {
+        setSlots(slotsRes.body);
+      } else {
         setError('Failed to load slots.');
-      } finally {
-        setLoadingSlots(false);
       }
-    };
+      if (bookingsRes.status === 200) {
+        setBookings(bookingsRes.body);
+      } else {
+        setError('Failed to load bookings.');
+      }
+    } catch (err) {
+      setError('Failed to load slots.');
+    } finally {
+      setLoadingSlots(false);
+      setLoadingBookings(false);
+    }
+  };
 
-    fetchSlots();
+  useEffect(() => {
+    fetchDashboard();
   }, []);
 
-  // Fetch bookings
+  // Apply live changes pushed by the facade instead of re-polling
   useEffect(() => {
-    const fetchBookings = async () => {
-      try {
-        const res = await axios.get(`${API_URL}/bookings`, {
-          headers: {
-            Authorization: `Bearer ${localStorage.getItem('token')}`,
-          },
-        });
-        setBookings(res.data);
-      } catch (err) {
-        setError('Failed to load bookings.');
-      } finally {
-        setLoadingBookings(false);
+    const email = localStorage.getItem('email');
+    const token = localStorage.getItem('token');
+    const wsUrl = `${API_URL.replace(/^http/, 'ws')}/ws/calendar?email=${encodeURIComponent(email)}&token=${encodeURIComponent(token)}`;
+    const socket = new WebSocket(wsUrl);
+
+    socket.onmessage = (event) => {
+      const delta = JSON.parse(event.data);
+      if (delta.t === 'slot.created') {
+        setSlots((prev) =>
+          prev.some((slot) => slot.slot_id === delta.id)
+            ? prev
+            : [...prev, { slot_id: delta.id, start_time: delta.s, end_time: delta.e }]
+        );
+      } else if (delta.t === 'slot.deleted' || delta.t === 'slot.booked') {
+        setSlots((prev) => prev.filter((slot) => slot.slot_id !== delta.id));
+      } else if (delta.t === 'booking.created') {
+        setBookings((prev) =>
+          prev.some((booking) => booking.slot_id === delta.id)
+            ? prev
+            : [...prev, { slot_id: delta.id, user_email: delta.by, start_time: delta.s, end_time: delta.e, participants: delta.with }]
+        );
+      } else if (delta.t === 'resync') {
+        fetchDashboard();
       }
     };
-    fetchBookings();
+
+    return () => socket.close();
   }, []);
 
 
@@ -0,0 +1,115 @@
+"""
+One-shot migration: adds startEpoch/endEpoch (integer epoch seconds) to
+TimeSlots and Reservations items written before they were stored, and the
+dayBucket that files a slot in the cross-host byDay index and the
+expiresAt TTL that lets DynamoDB drop it once it is long past.
+
+Each table is read with a parallel segmented scan, and every page is
+updated as soon as it arrives, at most MIGRATE_CONCURRENCY items at a time
+per segment, so memory stays at one page per segment. Items are changed
+with UpdateItem SET on the new attributes only, on condition that the row
+still holds the slot that was scanned. The services can keep running: a
+slot booked or deleted after the scan is not brought back, and a
+reservation row that a newer booking overwrote is left alone.
+
+    python -m utils.migrate_epoch --segments 8
+"""
+import argparse
+import asyncio
+import os
+import aioboto3
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv, find_dotenv
+from app.models.time_slots import day_bucket, slot_expiry, to_epoch
+
+load_dotenv(find_dotenv())
+
+AWS_REGION          = os.getenv("AWS_REGION", "eu-west-1")
+DYNAMODB_ENDPOINT   = os.getenv("DYNAMODB_ENDPOINT", "http://dynamodb-local:8000")
+SLOTS_TABLE         = os.getenv("SLOTS_TABLE", "TimeSlots")
+TABLES              = [SLOTS_TABLE, os.getenv("RESERVATIONS_TABLE", "Reservations")]
+MIGRATE_CONCURRENCY = int(os.getenv("MIGRATE_CONCURRENCY", 16))
+
+SLOT_KEY        = ("userEmail", "slotId")
+RESERVATION_KEY = ("participantEmail", "creatorEmail")
+
+
+def migrated_attributes(item: dict, is_slot: bool) -> dict:
+    values = {
+        "startEpoch": to_epoch(item["startTime"]),
+        "endEpoch":   to_epoch(item["endTime"]),
+    }
+    if is_slot:
+        values["dayBucket"] = day_bucket(values["startEpoch"])
+        values["expiresAt"] = slot_expiry(values["endEpoch"])
+    return values
+
+
+async def migrate_item(table, item: dict, is_slot: bool, stats: dict):
+    try:
+        values = migrated_attributes(item, is_slot)
+    except (KeyError, ValueError) as e:
+        stats["skipped"] += 1
+        print(f"⚠️  {table.name}: cannot migrate {item}: {e}")
+        return
+    try:
+        await table.update_item(
+            Key={name: item[name] for name in (SLOT_KEY if is_slot else RESERVATION_KEY)},
+            UpdateExpression="SET " + ", ".join(f"#{name} = :{name}" for name in values),
+            ExpressionAttributeNames={f"#{name}": name for name in values},
+            ExpressionAttributeValues={f":{name}": value for name, value in values.items()},
+            ConditionExpression=Attr("slotId").eq(item["slotId"]),
+        )
+        stats["migrated"] += 1
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        stats["gone"] += 1
+
+
+async def migrate_segment(table, segment: int, total: int, stats: dict):
+    is_slot = table.name == SLOTS_TABLE
+    missing = Attr("startEpoch").not_exists() | Attr("endEpoch").not_exists()
+    if is_slot:
+        missing = missing | Attr("dayBucket").not_exists() | Attr("expiresAt").not_exists()
+    kwargs = {
+        "Segment":          segment,
+        "TotalSegments":    total,
+        "FilterExpression": missing,
+    }
+    semaphore = asyncio.Semaphore(MIGRATE_CONCURRENCY)
+
+    async def migrate(item: dict):
+        async with semaphore:
+            await migrate_item(table, item, is_slot, stats)
+
+    while True:
+        resp = await table.scan(**kwargs)
+        stats["scanned"] += resp.get("ScannedCount", 0)
+        await asyncio.gather(*(migrate(item) for item in resp.get("Items", [])))
+        if "LastEvaluatedKey" not in resp:
+            return
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+async def migrate_table(dynamo, table_name: str, segments: int):
+    table = await dynamo.Table(table_name)
+    stats = {"scanned": 0, "migrated": 0, "skipped": 0, "gone": 0}
+    await asyncio.gather(*(migrate_segment(table, s, segments, stats) for s in range(segments)))
+    print(f"✅ {table_name}: {stats}")
+
+
+async def main(tables: list[str], segments: int):
+    session = aioboto3.Session()
+    async with session.resource("dynamodb", region_name=AWS_REGION, endpoint_url=DYNAMODB_ENDPOINT) as dynamo:
+        for table_name in tables:
+            await migrate_table(dynamo, table_name, segments)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", type=int, default=4, help="parallel scan segments per table")
+    parser.add_argument("--table", action="append", dest="tables", help="table to migrate (repeatable)")
+    args = parser.parse_args()
+    asyncio.run(main(args.tables or TABLES, args.segments))